@@ -6,3 +6,5 @@ __version__ = "0.0.1"
 
 
 from .bibdec import Bibliography
+
+__all__ = ["Bibliography"]
@@ -1,31 +1,141 @@
 from __future__ import annotations
 
-from copy import copy
 from functools import wraps
 from types import BuiltinFunctionType
-from typing import Callable, Dict, List, Optional, Set, TextIO, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    TextIO,
+    Tuple,
+    TypeVar,
+    Union,
+    cast,
+)
 
 import bibtexparser
 from bibtexparser.bibdatabase import BibDatabase
 from bibtexparser.bparser import BibTexParser
 
+# Maximum number of argument signatures and call names remembered per decorated function
+_MAX_CACHE_SIZE = 1024
+
+F = TypeVar("F", bound=Callable[..., Any])
+
 
 class PlaceholderArgument:
-    pass
+    __slots__ = ()
+
+
+# Shared placeholder passed for every argument when probing citation functions
+_PLACEHOLDER = PlaceholderArgument()
+
+
+def _format_function_name(function: Callable[..., Any]) -> str:
+    return function.__module__ + "." + function.__qualname__
 
 
-def _format_call_from_kwargs(function, kwargs):
-    function_name = f"{function.__module__}.{function.__qualname__}"
-    kwarg_str = ", ".join(f"{key}" for key in kwargs)
-    return f"{function_name}({kwarg_str})"
+def _format_call_from_kwargs(function_name: str, kwargs: Iterable[Any]) -> str:
+    return function_name + "(" + ", ".join(map(str, kwargs)) + ")"
 
 
-def _parse_keys(keys):
+def _parse_keys(keys: Union[str, Iterable[str], Mapping[str, Any]]) -> FrozenSet[str]:
     if isinstance(keys, str):
-        return {keys}
+        return frozenset((keys,))
     if isinstance(keys, dict):
-        return set.union(*(_parse_keys(k) for k in keys.values()))
-    return set(keys)
+        values = keys.values()
+        # Fast path for the common case where each signature cites a single key
+        if all(type(value) is str for value in values):
+            return frozenset(values)
+        return frozenset().union(*(_parse_keys(value) for value in values))
+    return frozenset(keys)
+
+
+def _make_wrapper(
+    f: F,
+    cite_function: Optional[Callable[..., Any]],
+    keys: Set[str],
+    citations: Dict[str, FrozenSet[str]],
+    record: Callable[[str, FrozenSet[str]], None],
+    cache: bool = False,
+) -> F:
+    """Create the wrapper that records the citations of ``f`` with ``record`` whenever it is called.
+
+    ``citations`` is the dictionary that ``record`` stores citations in, and is used
+    to skip recording a citation that is already stored. If ``cache`` is true, the
+    output of ``cite_function`` is cached based on the arguments of each call.
+
+    All state used by the wrapper lives in the closure of this function, so each call
+    only touches local and closure variables. With static keys, the citation is the same
+    for every call, so it is precomputed and only recorded if it is not already stored.
+    """
+    function_name = _format_function_name(f)
+    # Bind per-decoration constants to closure variables to avoid attribute lookups on each call
+    get_citation = citations.get
+
+    if cite_function is None:
+        call_name = _format_call_from_kwargs(function_name, ())
+        parsed_keys = frozenset(keys)
+
+        @wraps(f)
+        def wrapped_static(*args: Any, **kwargs: Any) -> Any:
+            out = f(*args, **kwargs)
+            if get_citation(call_name) is not parsed_keys:
+                record(call_name, parsed_keys)
+            return out
+
+        return cast(F, wrapped_static)
+
+    cite_cache: Dict[Tuple[Any, ...], Tuple[Optional[str], FrozenSet[str]]] = {}
+    get_cached = cite_cache.get
+    call_names: Dict[Tuple[Any, ...], str] = {}
+    call_prefix = function_name + "("
+
+    @wraps(f)
+    def wrapped(*args: Any, **kwargs: Any) -> Any:
+        out = f(*args, **kwargs)
+
+        signature: Optional[Tuple[Any, ...]] = None
+        cached = None
+        if cache:
+            # Look up the citations computed for a previous call with the same arguments.
+            # Types are part of the key, so equal values of different types (e.g. 1 and True) differ
+            try:
+                kwarg_items = tuple(sorted(kwargs.items())) if kwargs else ()
+                signature = (args, tuple(map(type, args)), kwarg_items, tuple(type(v) for _, v in kwarg_items))
+                cached = get_cached(signature)
+            except TypeError:  # Unhashable arguments, cannot cache
+                signature = None
+
+        if cached is None:
+            cites = cite_function(*args, **kwargs)
+            if len(cites) == 0:
+                cached = (None, frozenset())
+            else:
+                # Reuse the call name of previous citations with the same signatures
+                shape = tuple(cites)
+                call_name = call_names.get(shape)
+                if call_name is None:
+                    call_name = call_prefix + ", ".join(map(str, shape)) + ")"
+                    if len(call_names) < _MAX_CACHE_SIZE:
+                        call_names[shape] = call_name
+                cached = (call_name, _parse_keys(cites))
+            if signature is not None and len(cite_cache) < _MAX_CACHE_SIZE:
+                cite_cache[signature] = cached
+
+        # Update citation dictionary
+        call_name, parsed_keys = cached
+        if call_name is not None and get_citation(call_name) is not parsed_keys:
+            record(call_name, parsed_keys)
+        return out
+
+    return cast(F, wrapped)
 
 
 class Bibliography:
@@ -49,9 +159,12 @@ class Bibliography:
     Attributes
     ----------
     bib_database : bibtexparser.bibdatabase.BibDatabase
-    citations : Dict[str, Set[str]]
+        The parsed bibliography, parsed on first access. It is treated as immutable after construction,
+        so modifying it does not affect validation or the active bibliography.
+    citations : Dict[str, FrozenSet[str]]
         Dictionary with registered function calls as keys and the set of relevant
-        bibtex keys as values
+        bibtex keys as values. Each access returns a new snapshot, so modifying it
+        does not affect the bibliography. Use ``clear_citations`` to reset it.
     wrapped_functions : List[Callable]
         List of all functions monitored by the decorator
 
@@ -64,22 +177,56 @@ class Bibliography:
     ... print(bibliography.citations)
     ... double(x)
     {}
-    {"__main__.double()": {"key1", "key3"}}
+    {"__main__.double()": frozenset({"key1", "key3"})}
     """
 
-    def __init__(self, bibliography: str, parser: BibTexParser = None) -> None:
+    def __init__(self, bibliography: str, parser: Optional[BibTexParser] = None) -> None:
         self._full_bibliography = bibliography
-        self.bib_database = bibtexparser.loads(bibliography, parser=parser)
-        self.citations: Dict[str, Set[str]] = {}
-        self.wrapped_functions: List[Callable] = []
+        self._parser = parser
+        self._bib_database: Optional[BibDatabase] = None
+        self._entries_dict: Optional[Dict[str, Dict[str, Any]]] = None
+        self._entries_keys: Optional[Set[str]] = None
+        self._citations: Dict[str, FrozenSet[str]] = {}
+        self.wrapped_functions: List[Callable[..., Any]] = []
+        self._used_keys: Set[str] = set()
+        self._active_bibliography: Optional[str] = None
+        self._validated_cite_functions: Set[Callable[..., Any]] = set()
 
     @property
-    def full_bibliography(self):
+    def full_bibliography(self) -> str:
         """The string used to construct the database."""
         return self._full_bibliography
 
+    @property
+    def citations(self) -> Dict[str, FrozenSet[str]]:
+        """Snapshot of the registered function calls and the set of bibtex keys relevant for each of them."""
+        return dict(self._citations)
+
+    def clear_citations(self) -> None:
+        """Forget all registered function calls, e.g. to track citations of a new run."""
+        self._citations.clear()
+        self._used_keys = set()
+        self._active_bibliography = None
+
+    @property
+    def bib_database(self) -> BibDatabase:
+        """The parsed bibliography. The BibTeX string is parsed the first time it is needed."""
+        if self._bib_database is None:
+            self._bib_database = bibtexparser.loads(self._full_bibliography, parser=self._parser)
+        return self._bib_database
+
+    def _get_entries_dict(self) -> Dict[str, Dict[str, Any]]:
+        if self._entries_dict is None:
+            self._entries_dict = self.bib_database.entries_dict
+        return self._entries_dict
+
+    def _get_entries_keys(self) -> Set[str]:
+        if self._entries_keys is None:
+            self._entries_keys = set(self._get_entries_dict())
+        return self._entries_keys
+
     @classmethod
-    def load(cls, bibliography_file: TextIO, parser: BibTexParser = None) -> Bibliography:
+    def load(cls, bibliography_file: TextIO, parser: Optional[BibTexParser] = None) -> Bibliography:
         """Load bibliography from file.
 
         Parameters
@@ -89,77 +236,143 @@ class Bibliography:
         parser : bibtexparser.bparser.BibTexParser [Optional]
             Custom BibTexParser parser used to load the bibliography
         """
-        return cls(bibliography_file.read())
+        return cls(bibliography_file.read(), parser=parser)
 
-    def __len__(self):
+    def __len__(self) -> int:
         return len(self.bib_database.entries)
 
     def _check_validity_of_citation(
-        self, keys: Union[None, Set[str], str], cite_function: Union[None, Callable], wrapped_function: Callable
+        self,
+        keys: Union[None, Set[str], str],
+        cite_function: Union[None, Callable[..., Any]],
+        wrapped_function: Callable[..., Any],
+        declared_keys: Union[None, Set[str], str] = None,
+        cache: bool = False,
     ) -> None:
         if keys is None and cite_function is None:
             raise ValueError("Must supply either set of bibtex keys or citation function.")
         if keys is not None and cite_function is not None:
             raise ValueError("Must supply either set of bibtex keys or citation function, not both.")
+        if declared_keys is not None and cite_function is None:
+            raise ValueError("Declared keys can only be supplied together with a citation function.")
+        if cache and cite_function is None:
+            raise ValueError("Caching can only be enabled together with a citation function.")
+        function_name = _format_function_name(wrapped_function)
 
         if cite_function is not None:
-            # Check that citation function has correct format
-            ## Only one keyword only argument: __check_validity__
-
-            # Count number of keyword only arguments
-            num_kwonly = cite_function.__code__.co_kwonlyargcount
-            kwdefaults = cite_function.__kwdefaults__  # type: ignore
-            if kwdefaults is None:
-                kwdefaults = {}
+            if declared_keys is None:
+                declared_keys = getattr(cite_function, "__cited_keys__", None)
+            cite_function_name = _format_function_name(cite_function)
 
-            error_message = (
-                f"Citation function `{cite_function.__module__}.{cite_function.__qualname__}` "
-                "should have only one keyword-only argument `__check_validity__` with default value `False`."
-            )
-            if num_kwonly != 1:
-                raise ValueError(error_message)
+            # Check that citation function has correct format
+            ## Only one keyword only argument: __check_validity__ (not needed if the keys are declared)
+            if declared_keys is None:
+                # Count number of keyword only arguments
+                num_kwonly = cite_function.__code__.co_kwonlyargcount
+                kwdefaults = cite_function.__kwdefaults__
+                if kwdefaults is None:
+                    kwdefaults = {}
+
+                error_message = (
+                    f"Citation function `{cite_function_name}` "
+                    "should have only one keyword-only argument `__check_validity__` with default value `False`."
+                )
+                if num_kwonly != 1:
+                    raise ValueError(error_message)
 
-            if "__check_validity__" not in kwdefaults:
-                raise ValueError(error_message)
+                if "__check_validity__" not in kwdefaults:
+                    raise ValueError(error_message)
 
-            if kwdefaults.get("__check_validity__", True):
-                raise ValueError("Default value of `__check_validity__` should be False.")
+                if kwdefaults.get("__check_validity__", True):
+                    raise ValueError("Default value of `__check_validity__` should be False.")
 
             ## Citation function has same number of arguments as function
             argcount = wrapped_function.__code__.co_argcount + wrapped_function.__code__.co_kwonlyargcount
             if cite_function.__code__.co_argcount != argcount:
-                cite_function_name = f"{cite_function.__module__}.{cite_function.__qualname__}"
-                function_name = f"{wrapped_function.__module__}.{wrapped_function.__qualname__}"
                 raise TypeError(
                     f"Citation function, `{cite_function_name}`, should have the same number "
                     f"of arguments as wrapped function, `{function_name}`."
                 )
 
             ## All possible citation keys are in the bibliography
-            args = (PlaceholderArgument() for _ in range(cite_function.__code__.co_argcount))
-            for signature, citation_keys in cite_function(*args, __check_validity__=True).items():
-                if isinstance(citation_keys, str):
-                    citation_keys = {citation_keys}
-                for citation_key in citation_keys:
-                    if citation_key not in self.bib_database.entries_dict:
-                        signature = f"{wrapped_function.__module__}.{wrapped_function.__qualname__}({signature})"
-                        raise ValueError(f"{citation_key} not in bibliography, but occurs for {signature}.")
+            if declared_keys is not None:
+                # Validate the declared superset of keys instead of probing the citation function
+                keys = {declared_keys} if isinstance(declared_keys, str) else declared_keys
+            elif cite_function in self._validated_cite_functions:
+                return
+            else:
+                args = (_PLACEHOLDER,) * cite_function.__code__.co_argcount
+                possible_cites = cite_function(*args, __check_validity__=True)
+                missing_keys = _parse_keys(possible_cites) - self._get_entries_keys()
+                if missing_keys:
+                    occurrences = []
+                    for signature, citation_keys in possible_cites.items():
+                        missing_in_signature = _parse_keys(citation_keys) & missing_keys
+                        if missing_in_signature:
+                            signature = _format_call_from_kwargs(function_name, (signature,))
+                            occurrences.append(
+                                f"{', '.join(sorted(missing_in_signature))} not in bibliography, "
+                                f"but occurs for {signature}"
+                            )
+                    raise ValueError("; ".join(occurrences) + ".")
+                self._validated_cite_functions.add(cite_function)
 
         if keys is not None:
             ## All possible citation keys are in the bibliography
-            signature = f"{wrapped_function.__module__}.{wrapped_function.__qualname__}()"
-            for citation_key in keys:
-                if citation_key not in self.bib_database.entries_dict:
-                    raise ValueError(f"{citation_key} not in bibliography, but occurs for {signature}.")
+            missing_keys = frozenset(keys) - self._get_entries_keys()
+            if missing_keys:
+                signature = _format_call_from_kwargs(function_name, ())
+                raise ValueError(f"{', '.join(sorted(missing_keys))} not in bibliography, but occurs for {signature}.")
+
+    def _record_citation(self, call_name: str, keys: FrozenSet[str]) -> None:
+        """Store the citation keys of a function call and keep the set of used keys up to date."""
+        previous_keys = self._citations.get(call_name)
+        self._citations[call_name] = keys
+        if previous_keys is not None and not previous_keys <= keys:
+            # Some keys were dropped, and may no longer be used by any call
+            self._used_keys = set().union(*self._citations.values())
+            self._active_bibliography = None
+        elif not self._used_keys.issuperset(keys):
+            self._used_keys.update(keys)
+            self._active_bibliography = None
 
     def register_cites(
-        self, keys: Optional[Union[Set[str], str]] = None, cite_function: Optional[Callable] = None
-    ) -> Callable:
-        """Register citations used by the specified function."""
+        self,
+        keys: Optional[Union[Set[str], str]] = None,
+        cite_function: Optional[Callable[..., Any]] = None,
+        declared_keys: Optional[Union[Set[str], str]] = None,
+        cache: bool = False,
+    ) -> Callable[[F], F]:
+        """Register citations used by the specified function.
 
-        def decorator(f):
-            nonlocal self, keys, cite_function
+        Parameters
+        ----------
+        keys : str or Set[str] [Optional]
+            Bibtex key(s) cited whenever the decorated function is called.
+            Either this or ``cite_function`` must be supplied, not both.
+        cite_function : Callable [Optional]
+            Function that is called with the same arguments as the decorated function and
+            returns a dictionary mapping signatures (e.g. ``"a=1"``) to the bibtex key(s) they
+            cite. It is called with ``__check_validity__=True`` when a function is decorated,
+            and should then return every citation it can produce so that they can be checked
+            against the bibliography. All its arguments are then the same ``PlaceholderArgument``
+            instance, so they cannot be told apart by identity.
+        declared_keys : str or Set[str] [Optional]
+            Every bibtex key ``cite_function`` can return. Can also be given as a ``__cited_keys__``
+            attribute on ``cite_function``. If declared, only these keys are checked against the
+            bibliography, ``cite_function`` is not called when a function is decorated and does
+            not need the ``__check_validity__`` argument. Must be a superset of every key
+            ``cite_function`` can return. Only valid together with ``cite_function``.
+        cache : bool [Optional]
+            If True, the output of ``cite_function`` is cached based on the arguments of each
+            call, and reused for later calls with equal arguments of the same types. Only use this
+            if the citations depend on the argument values alone, e.g. numbers and strings. Objects
+            that change state between calls, such as ``self`` for a method, would give stale
+            citations. The cache keeps up to 1024 sets of arguments alive per decorated function.
+            Only valid together with ``cite_function``. Default is False.
+        """
 
+        def decorator(f: F) -> F:
             if isinstance(f, BuiltinFunctionType):
                 raise TypeError(
                     "Cannot wrap builtins or C-functions."
@@ -168,31 +381,15 @@ class Bibliography:
             elif isinstance(f, type):
                 raise TypeError("Cannot wrap types or classes. Wrap the constructor instead.")
             self.wrapped_functions.append(f)
-            if isinstance(keys, str):
-                keys = {keys}
-
-            self._check_validity_of_citation(keys, cite_function, f)
-            if keys is None:
-                keys = set()
-            cites = {"": set(keys)}
-
-            @wraps(f)
-            def wrapped(*args, **kwargs):
-                nonlocal cites
-                out = f(*args, **kwargs)
-
-                # Get cites
-                if cite_function is not None:
-                    cites = cite_function(*args, **kwargs)
-
-                # Update citation dictionary
-                if len(cites) == 0:
-                    return out
-                call_name = _format_call_from_kwargs(f, cites)
-                self.citations[call_name] = _parse_keys(cites)
-                return out
+            citation_keys = {keys} if isinstance(keys, str) else keys
 
-            return wrapped
+            self._check_validity_of_citation(citation_keys, cite_function, f, declared_keys, cache)
+            if cite_function is None and not citation_keys:
+                # Nothing can ever be cited, so there is no need to monitor calls
+                return f
+            if citation_keys is None:
+                citation_keys = set()
+            return _make_wrapper(f, cite_function, citation_keys, self._citations, self._record_citation, cache)
 
         return decorator
 
@@ -202,9 +399,11 @@ class Bibliography:
 
         An active entry is an entry in the database that is relevant to at least one used function call.
         """
-        active_database = BibDatabase()
-        if len(self.citations) == 0:
+        if len(self._citations) == 0:
             return ""
-        used_keys = set.union(*self.citations.values())
-        active_database.entries = [entry for key, entry in self.bib_database.entries_dict.items() if key in used_keys]
-        return bibtexparser.dumps(active_database)
+        if self._active_bibliography is None:
+            active_database = BibDatabase()
+            entries_dict = self._get_entries_dict()
+            active_database.entries = [entries_dict[key] for key in self._used_keys if key in entries_dict]
+            self._active_bibliography = bibtexparser.dumps(active_database)
+        return self._active_bibliography
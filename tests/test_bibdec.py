@@ -1,3 +1,4 @@
+import pickle
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from textwrap import dedent
@@ -147,6 +148,21 @@ def test_multiple_cites_cite_function_works(bibliography):
     assert any("b=1" in signature for signature in bibliography.citations)
 
 
+def test_cite_function_signatures_need_not_be_strings(bibliography):
+    def cite_function(a, *, __check_validity__=False):
+        if a == 1 or __check_validity__:
+            return {("a", 1): "key1"}
+        return {}
+
+    @bibliography.register_cites(cite_function=cite_function)
+    def simple_function(a):
+        return a
+
+    assert simple_function(1) == 1
+    assert {"key1"} in bibliography.citations.values()
+    assert any("('a', 1)" in signature for signature in bibliography.citations)
+
+
 def test_cite_function_must_have_same_number_of_arguments(bibliography):
     with pytest.raises(TypeError):
 
@@ -171,3 +187,224 @@ def test_class_raises_type_error(bibliography):
 
         bibliography.register_cites("key1")(F)
         bibliography.register_cites("key1")(range)
+
+
+def test_cite_function_is_cached_for_repeated_arguments(bibliography):
+    num_calls = 0
+
+    def cite_function(a, *, __check_validity__=False):
+        nonlocal num_calls
+        num_calls += 1
+        if a == 1 or __check_validity__:
+            return {"a=1": "key1"}
+        return {}
+
+    @bibliography.register_cites(cite_function=cite_function, cache=True)
+    def simple_function(a):
+        pass
+
+    num_calls = 0
+    simple_function(1)
+    simple_function(1)
+    assert num_calls == 1
+    assert {"key1"} in bibliography.citations.values()
+
+    simple_function([1])
+    simple_function([1])
+    assert num_calls == 3
+
+    simple_function(True)
+    assert num_calls == 4
+
+    with pytest.raises(ValueError):
+
+        @bibliography.register_cites("key2", cache=True)
+        def static_function():
+            pass
+
+
+def test_cite_function_sees_changed_object_state(bibliography):
+    def cite_function(self, *, __check_validity__=False):
+        citations = {}
+        if __check_validity__ or self.method == "a":
+            citations["method=a"] = "key1"
+        if __check_validity__ or self.method == "b":
+            citations["method=b"] = "key2"
+        return citations
+
+    class Solver:
+        def __init__(self, method):
+            self.method = method
+
+        @bibliography.register_cites(cite_function=cite_function)
+        def run(self):
+            pass
+
+    solver = Solver("a")
+    solver.run()
+    solver.method = "b"
+    solver.run()
+    assert len(bibliography.citations) == 2
+    assert {"key2"} in bibliography.citations.values()
+
+
+def test_active_bibliography_contains_used_entries(bibliography):
+    @bibliography.register_cites("key1")
+    def first_function():
+        pass
+
+    @bibliography.register_cites({"key1", "key3"})
+    def second_function():
+        pass
+
+    assert bibliography.active_bibliography == ""
+
+    first_function()
+    active_bibliography = bibliography.active_bibliography
+    assert "key1" in active_bibliography
+    assert "key3" not in active_bibliography
+
+    first_function()
+    assert bibliography.active_bibliography is active_bibliography
+
+    second_function()
+    assert "key1" in bibliography.active_bibliography
+    assert "key3" in bibliography.active_bibliography
+    assert "key2" not in bibliography.active_bibliography
+
+
+def test_cite_function_is_validated_once(bibliography):
+    num_checks = 0
+
+    def cite_function(a, *, __check_validity__=False):
+        nonlocal num_checks
+        num_checks += __check_validity__
+        return {"a=1": "key1"}
+
+    @bibliography.register_cites(cite_function=cite_function)
+    def first_function(a):
+        pass
+
+    @bibliography.register_cites(cite_function=cite_function)
+    def second_function(a):
+        pass
+
+    assert num_checks == 1
+
+
+def test_declared_keys_skip_cite_function_probe(bibliography):
+    def cite_function(a):
+        return {"a=1": "key1"} if a == 1 else {}
+
+    @bibliography.register_cites(cite_function=cite_function, declared_keys={"key1", "key2"})
+    def simple_function(a):
+        pass
+
+    simple_function(1)
+    assert {"key1"} in bibliography.citations.values()
+
+    cite_function.__cited_keys__ = {"key1"}
+
+    @bibliography.register_cites(cite_function=cite_function)
+    def other_function(a):
+        pass
+
+    with pytest.raises(ValueError):
+
+        @bibliography.register_cites(cite_function=cite_function, declared_keys={"nonexistent_key"})
+        def function_with_error(a):
+            pass
+
+
+def test_decorator_can_be_reused(bibliography):
+    def cite_function(a, *, __check_validity__=False):
+        return {"a=1": "key1"}
+
+    register_cites = bibliography.register_cites(cite_function=cite_function)
+
+    @register_cites
+    def first_function(a):
+        pass
+
+    @register_cites
+    def second_function(a):
+        pass
+
+    first_function(1)
+    second_function(1)
+    assert len(bibliography.citations) == 2
+
+
+def test_active_bibliography_drops_replaced_keys(bibliography):
+    def cite_function(a, b, *, __check_validity__=False):
+        if __check_validity__:
+            return {"a=1": {"key1", "key2"}}
+        return {"a=1": "key1" if b else {"key1", "key2"}} if a == 1 else {}
+
+    @bibliography.register_cites(cite_function=cite_function)
+    def simple_function(a, b):
+        pass
+
+    simple_function(1, False)
+    assert "key2" in bibliography.active_bibliography
+
+    simple_function(1, True)
+    assert "key1" in bibliography.active_bibliography
+    assert "key2" not in bibliography.active_bibliography
+
+
+def test_keys_are_validated_against_parsed_entries(bibliography_string):
+    bibliography_string += dedent(
+        """\
+        % @article{commented_out, title = {Commented out}}
+
+        @comment{@article{in_comment, title = {Inside a comment}}}
+
+        @article{Key:2020(a),
+          title = {Key with parentheses},
+          note = {@book{in_field, x}}
+        }
+        """
+    )
+    bibliography = Bibliography(bibliography_string)
+
+    @bibliography.register_cites("Key:2020(a)")
+    def some_function():
+        pass
+
+    some_function()
+    assert "Key:2020(a)" in bibliography.active_bibliography
+
+    for key in ("commented_out", "in_comment", "in_field"):
+        with pytest.raises(ValueError):
+            bibliography.register_cites(key)(lambda: None)
+
+
+def test_empty_keys_are_not_registered(bibliography):
+    def some_function():
+        pass
+
+    assert bibliography.register_cites(set())(some_function) is some_function
+    some_function()
+    assert len(bibliography.citations) == 0
+    assert bibliography.active_bibliography == ""
+
+
+def test_citations_are_a_snapshot_and_can_be_cleared(bibliography):
+    @bibliography.register_cites("key1")
+    def some_function():
+        pass
+
+    some_function()
+    citations = bibliography.citations
+    assert pickle.loads(pickle.dumps(citations)) == citations
+    citations.clear()
+    assert len(bibliography.citations) == 1
+
+    bibliography.clear_citations()
+    assert len(bibliography.citations) == 0
+    assert bibliography.active_bibliography == ""
+
+    some_function()
+    assert {"key1"} in bibliography.citations.values()
+    assert "key1" in bibliography.active_bibliography